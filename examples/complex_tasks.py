@@ -1,14 +1,15 @@
+import asyncio
 import time
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import TypedDict
+from typing import NotRequired, TypedDict
 
 import numpy as np
 
-from lazypp import BaseTask, File
+from lazypp import BaseTask, File, get_default_worker
+from lazypp.io import batch_write
 
 cache_dir = Path("cache").resolve()
-worker = ProcessPoolExecutor(max_workers=8)
 
 
 class TestBaseTask[INPUT, OUTPUT](BaseTask[INPUT, OUTPUT]):
@@ -16,12 +17,29 @@ class TestBaseTask[INPUT, OUTPUT](BaseTask[INPUT, OUTPUT]):
         super().__init__(
             cache_dir=cache_dir,
             input=input,
-            worker=worker,
+            worker=get_default_worker(),
             show_input=True,
             show_output=True,
         )
 
 
+def _parse_value(content: bytes) -> int:
+    """Parse the b"value: N" payload written by the tasks below"""
+    return int(content.split(b":", 1)[1])
+
+
+def _input_values(input) -> np.ndarray:
+    """
+    Prefer the in-memory "values" channel when the caller wired it up;
+    fall back to parsing the value files otherwise
+    """
+    if "values" in input:
+        return np.asarray(input["values"], dtype=np.int64)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        contents = pool.map(lambda file: Path(file.path).read_bytes(), input["files"])
+    return np.fromiter(map(_parse_value, contents), dtype=np.int64)
+
+
 class CreateFileInputParameters(TypedDict):
     min: int
     max: int
@@ -41,21 +59,18 @@ class CreateFileOutput(TypedDict):
 class CreateFileTask(TestBaseTask[CreateFileInput, CreateFileOutput]):
     def task(self, input) -> CreateFileOutput:
         time.sleep(0.2)
-        files = []
-        values = []
-        for i in range(
-            input["param"]["min"], input["param"]["max"], input["param"]["delta"]
-        ):
-            with open(f"file_{i}.txt", "w") as f:
-                f.write(f"value: {i}")
-            files.append(File(f"file_{i}.txt"))
-            values.append(i)
+        values = list(
+            range(input["param"]["min"], input["param"]["max"], input["param"]["delta"])
+        )
+        batch_write((f"file_{i}.txt", f"value: {i}".encode()) for i in values)
+        files = [File(f"file_{i}.txt") for i in values]
         return {"files": files, "values": values}
 
 
 ### Summation Task
 class SummationInput(TypedDict):
     files: list[File]
+    values: NotRequired[list[int]]
     shift: int
 
 
@@ -67,24 +82,19 @@ class SummationOutput(TypedDict):
 class SummationTask(TestBaseTask[SummationInput, SummationOutput]):
     def task(self, input) -> SummationOutput:
         time.sleep(0.2)
-        values = []
-        files = []
-        for i, file in enumerate(input["files"]):
-            with open(file.path, "r") as f:
-                content = f.read()
-                val = int(content.split(":")[1].strip())
-            with open(f"{self.hash}_output_{i}.txt", "w") as f:
-                f.write(f"value: {val + input["shift"]}")
-            values.append(val + input["shift"])
-
-        for i in range(len(input["files"])):
-            files.append(File(f"{self.hash}_output_{i}.txt"))
+        values = (_input_values(input) + input["shift"]).tolist()
+        batch_write(
+            (f"{self.hash}_output_{i}.txt", f"value: {value}".encode())
+            for i, value in enumerate(values)
+        )
+        files = [File(f"{self.hash}_output_{i}.txt") for i in range(len(values))]
         return {"files": files, "values": values}
 
 
 ### Subtraction Task
 class SubtractInput(TypedDict):
     files: list[File]
+    values: NotRequired[list[int]]
     subtrahend: int
 
 
@@ -96,24 +106,19 @@ class SubtractOutput(TypedDict):
 class SubtractTask(TestBaseTask[SubtractInput, SubtractOutput]):
     def task(self, input) -> SubtractOutput:
         time.sleep(0.2)
-        values = []
-        files = []
-        for i, file in enumerate(input["files"]):
-            with open(file.path, "r") as f:
-                content = f.read()
-                val = int(content.split(":")[1].strip())
-            with open(f"{self.hash}_output_{i}.txt", "w") as f:
-                f.write(f"value: {val - input["subtrahend"]}")
-            values.append(val - input["subtrahend"])
-
-        for i in range(len(input["files"])):
-            files.append(File(f"{self.hash}_output_{i}.txt"))
+        values = (_input_values(input) - input["subtrahend"]).tolist()
+        batch_write(
+            (f"{self.hash}_output_{i}.txt", f"value: {value}".encode())
+            for i, value in enumerate(values)
+        )
+        files = [File(f"{self.hash}_output_{i}.txt") for i in range(len(values))]
         return {"files": files, "values": values}
 
 
 ### Multiplier Task
 class MultiplyInput(TypedDict):
     files: list[File]
+    values: NotRequired[list[int]]
     multiplier: int
 
 
@@ -125,24 +130,19 @@ class MultiplyOutput(TypedDict):
 class MultiplyTask(TestBaseTask[MultiplyInput, MultiplyOutput]):
     def task(self, input) -> MultiplyOutput:
         time.sleep(0.2)
-        values = []
-        files = []
-        for i, file in enumerate(input["files"]):
-            with open(file.path, "r") as f:
-                content = f.read()
-                val = int(content.split(":")[1].strip())
-            with open(f"{self.hash}_output_{i}.txt", "w") as f:
-                f.write(f"value: {val * input["multiplier"]}")
-            values.append(val * input["multiplier"])
-
-        for i in range(len(input["files"])):
-            files.append(File(f"{self.hash}_output_{i}.txt"))
+        values = (_input_values(input) * input["multiplier"]).tolist()
+        batch_write(
+            (f"{self.hash}_output_{i}.txt", f"value: {value}".encode())
+            for i, value in enumerate(values)
+        )
+        files = [File(f"{self.hash}_output_{i}.txt") for i in range(len(values))]
         return {"files": files, "values": values}
 
 
 ### Summation All Task
 class SummationAllInput(TypedDict):
     files: list[File]
+    values: NotRequired[list[int]]
 
 
 class SummationAllOutput(TypedDict):
@@ -153,12 +153,7 @@ class SummationAllOutput(TypedDict):
 class SummationAllTask(TestBaseTask[SummationAllInput, SummationAllOutput]):
     def task(self, input) -> SummationAllOutput:
         time.sleep(0.2)
-        value = 0
-        for file in input["files"]:
-            with open(file.path, "r") as f:
-                content = f.read()
-                val = int(content.split(":")[1].strip())
-            value += val
+        value = int(_input_values(input).sum())
         with open(f"{self.hash}_output.txt", "w") as f:
             f.write(f"value: {value}")
         return {"file": File(f"{self.hash}_output.txt"), "value": value}
@@ -215,7 +210,7 @@ def task(min: int, max: int, delta: int, multiplier: int, params: TaskParameters
     }
 
 
-def main():
+async def main():
     task_params = {
         "min": 0,
         "max": 10,
@@ -239,26 +234,37 @@ def main():
     v2_task = MultiplyTask(
         input={
             "files": v1_task.output["files"],
+            "values": v1_task.output["values"],
             "multiplier": task_params["multiplier"],
         }
     )
 
     added_v1_task = SummationTask(
-        input={"files": v1_task.output["files"], "shift": task_params["params"]["plus"]}
+        input={
+            "files": v1_task.output["files"],
+            "values": v1_task.output["values"],
+            "shift": task_params["params"]["plus"],
+        }
     )
     added_v2_task = SummationTask(
-        input={"files": v2_task.output["files"], "shift": task_params["params"]["plus"]}
+        input={
+            "files": v2_task.output["files"],
+            "values": v2_task.output["values"],
+            "shift": task_params["params"]["plus"],
+        }
     )
 
     sub_v1_task = SubtractTask(
         input={
             "files": v1_task.output["files"],
+            "values": v1_task.output["values"],
             "subtrahend": task_params["params"]["sub"],
         }
     )
     sub_v2_task = SubtractTask(
         input={
             "files": v2_task.output["files"],
+            "values": v2_task.output["values"],
             "subtrahend": task_params["params"]["sub"],
         }
     )
@@ -266,24 +272,56 @@ def main():
     mul_v1_task = MultiplyTask(
         input={
             "files": v1_task.output["files"],
+            "values": v1_task.output["values"],
             "multiplier": task_params["params"]["mul"],
         }
     )
     mul_v2_task = MultiplyTask(
         input={
             "files": v2_task.output["files"],
+            "values": v2_task.output["values"],
             "multiplier": task_params["params"]["mul"],
         }
     )
 
-    sum_added_v1_task = SummationAllTask(input={"files": added_v1_task.output["files"]})
-    sum_added_v2_task = SummationAllTask(input={"files": added_v2_task.output["files"]})
+    sum_added_v1_task = SummationAllTask(
+        input={
+            "files": added_v1_task.output["files"],
+            "values": added_v1_task.output["values"],
+        }
+    )
+    sum_added_v2_task = SummationAllTask(
+        input={
+            "files": added_v2_task.output["files"],
+            "values": added_v2_task.output["values"],
+        }
+    )
 
-    sum_sub_v1_task = SummationAllTask(input={"files": sub_v1_task.output["files"]})
-    sum_sub_v2_task = SummationAllTask(input={"files": sub_v2_task.output["files"]})
+    sum_sub_v1_task = SummationAllTask(
+        input={
+            "files": sub_v1_task.output["files"],
+            "values": sub_v1_task.output["values"],
+        }
+    )
+    sum_sub_v2_task = SummationAllTask(
+        input={
+            "files": sub_v2_task.output["files"],
+            "values": sub_v2_task.output["values"],
+        }
+    )
 
-    sum_mul_v1_task = SummationAllTask(input={"files": mul_v1_task.output["files"]})
-    sum_mul_v2_task = SummationAllTask(input={"files": mul_v2_task.output["files"]})
+    sum_mul_v1_task = SummationAllTask(
+        input={
+            "files": mul_v1_task.output["files"],
+            "values": mul_v1_task.output["values"],
+        }
+    )
+    sum_mul_v2_task = SummationAllTask(
+        input={
+            "files": mul_v2_task.output["files"],
+            "values": mul_v2_task.output["values"],
+        }
+    )
 
     sum_all_task = SummationAllTask(
         input={
@@ -298,22 +336,23 @@ def main():
         }
     )
 
-    assert v1_task.result()["values"] == list(expected_output["v1"])
-    assert v2_task.result()["values"] == list(expected_output["v2"])
-    assert added_v1_task.result()["values"] == list(expected_output["added_v1"])
-    assert added_v2_task.result()["values"] == list(expected_output["added_v2"])
-    assert sub_v1_task.result()["values"] == list(expected_output["sub_v1"])
-    assert sub_v2_task.result()["values"] == list(expected_output["sub_v2"])
-    assert mul_v1_task.result()["values"] == list(expected_output["mul_v1"])
-    assert mul_v2_task.result()["values"] == list(expected_output["mul_v2"])
-    assert sum_added_v1_task.result()["value"] == expected_output["sum_added_v1"]
-    assert sum_added_v2_task.result()["value"] == expected_output["sum_added_v2"]
-    assert sum_sub_v1_task.result()["value"] == expected_output["sum_sub_v1"]
-    assert sum_sub_v2_task.result()["value"] == expected_output["sum_sub_v2"]
-    assert sum_mul_v1_task.result()["value"] == expected_output["sum_mul_v1"]
-    assert sum_mul_v2_task.result()["value"] == expected_output["sum_mul_v2"]
-    assert sum_all_task.result()["value"] == expected_output["sum_all"]
+    assert (await v1_task())["values"] == list(expected_output["v1"])
+    assert (await v2_task())["values"] == list(expected_output["v2"])
+    assert (await added_v1_task())["values"] == list(expected_output["added_v1"])
+    assert (await added_v2_task())["values"] == list(expected_output["added_v2"])
+    assert (await sub_v1_task())["values"] == list(expected_output["sub_v1"])
+    assert (await sub_v2_task())["values"] == list(expected_output["sub_v2"])
+    assert (await mul_v1_task())["values"] == list(expected_output["mul_v1"])
+    assert (await mul_v2_task())["values"] == list(expected_output["mul_v2"])
+    assert (await sum_added_v1_task())["value"] == expected_output["sum_added_v1"]
+    assert (await sum_added_v2_task())["value"] == expected_output["sum_added_v2"]
+    assert (await sum_sub_v1_task())["value"] == expected_output["sum_sub_v1"]
+    assert (await sum_sub_v2_task())["value"] == expected_output["sum_sub_v2"]
+    assert (await sum_mul_v1_task())["value"] == expected_output["sum_mul_v1"]
+    assert (await sum_mul_v2_task())["value"] == expected_output["sum_mul_v2"]
+    assert (await sum_all_task())["value"] == expected_output["sum_all"]
 
 
 if __name__ == "__main__":
-    main()
+    # one loop for the whole graph instead of one per .result() call
+    asyncio.run(main())
@@ -1,25 +1,26 @@
 import os
-from concurrent.futures import ProcessPoolExecutor
+import tempfile
 from pathlib import Path
 from typing import TypedDict
 
+import numpy as np
+
 import lazypp
 import lazypp.task
-from lazypp import BaseTask, Directory, File
+from lazypp import BaseTask, Directory, File, get_default_worker
+from lazypp.io import batch_write
 
 lazypp.task._DEBUG = True
 
-WORKER = ProcessPoolExecutor(max_workers=4)
+cache_dir = Path("cache").resolve()
 
 
 class TestBaseTask[INPUT, OUTPUT](BaseTask[INPUT, OUTPUT]):
-    _worker = ProcessPoolExecutor(max_workers=4)
-
     def __init__(self, input: INPUT):
         super().__init__(
-            cache_dir=Path("cache").resolve(),
+            cache_dir=cache_dir,
             input=input,
-            worker=TestBaseTask._worker,
+            worker=get_default_worker(),
         )
 
 
@@ -37,14 +38,14 @@ class CreateFiles(TestBaseTask[FInput, FOutput]):
         n = int(input["n"])
         delta = int(input["delta"])
 
-        if not os.path.exists("files"):
-            os.mkdir("files")
-
-        content = 0
-        for i in range(0, n):
-            with open(f"files/file_{i}.txt", "w") as f:
-                f.write(str(content))
-            content += delta
+        # write into a fresh temp dir and publish it with one atomic
+        # rename; no exists/mkdir race, no stale files from a prior run
+        tmp = tempfile.mkdtemp(dir=".")
+        values = np.arange(n, dtype=np.int64) * delta
+        batch_write(
+            (f"{tmp}/file_{i}.txt", b"%d" % value) for i, value in enumerate(values)
+        )
+        os.replace(tmp, "files")
 
         return {"files": Directory(path="files")}
 
@@ -60,17 +61,15 @@ class SumOutput(TypedDict):
 
 class SumFiles(TestBaseTask[SumInput, SumOutput]):
     def task(self, input):
-        files = os.listdir(input["files"].output["files"].path)
-        total = 0
-        for file in files:
-            with open(f"{input['files'].output["files"].path}/{file}", "r") as f:
-                total += int(f.read())
-        sum = str(total)
+        files_dir = input["files"].output["files"].path
+        with os.scandir(files_dir) as it:
+            total = sum(int(Path(entry.path).read_bytes()) for entry in it)
+        result = str(total)
 
         with open("result.txt", "w") as f:
-            f.write(sum)
+            f.write(result)
 
-        return SumOutput({"sum": sum, "result_file": File(path="result.txt")})
+        return SumOutput({"sum": result, "result_file": File(path="result.txt")})
 
 
 if __name__ == "__main__":
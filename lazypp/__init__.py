@@ -1,4 +1,5 @@
+from lazypp.executor import get_default_worker
 from lazypp.file_objects import BaseEntry, Directory, File
 from lazypp.task import BaseTask
 
-__all__ = ["File", "Directory", "BaseEntry", "BaseTask"]
+__all__ = ["File", "Directory", "BaseEntry", "BaseTask", "get_default_worker"]
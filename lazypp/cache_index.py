@@ -0,0 +1,63 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import lazypp.file_objects
+
+
+class CacheIndex:
+    """
+    Disk-backed index of cached entries keyed by content hash
+
+    Looking an entry up through SQLite costs one indexed query instead of
+    the per-file exists/open probes that dominate once a cache directory
+    grows large.
+    """
+
+    _instances: dict[str, "CacheIndex"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, cache_dir: str | Path):
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(
+            Path(cache_dir) / "index.sqlite", check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(hash TEXT PRIMARY KEY, kind TEXT, pickled BLOB, mtime REAL)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def for_dir(cls, cache_dir: str | Path) -> "CacheIndex":
+        """Return the shared index for cache_dir, creating it on first use"""
+        key = str(Path(cache_dir).resolve())
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(cache_dir)
+            return cls._instances[key]
+
+    def record(self, entry: "lazypp.file_objects.BaseEntry"):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+            (
+                entry._content_digest(),
+                type(entry).__name__,
+                pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL),
+                time.time(),
+            ),
+        )
+        self._conn.commit()
+
+    def get(self, hash: str) -> "lazypp.file_objects.BaseEntry | None":
+        row = self._conn.execute(
+            "SELECT pickled FROM entries WHERE hash = ?", (hash,)
+        ).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
@@ -0,0 +1,22 @@
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+_default_worker: ProcessPoolExecutor | None = None
+_default_worker_lock = threading.Lock()
+
+
+def get_default_worker() -> ProcessPoolExecutor:
+    """
+    Return the process-wide default ProcessPoolExecutor
+
+    The pool is created lazily on first access and shut down at
+    interpreter exit, so importing callers share one pool instead of
+    paying pool startup/teardown per module.
+    """
+    global _default_worker
+    with _default_worker_lock:
+        if _default_worker is None:
+            _default_worker = ProcessPoolExecutor()
+            atexit.register(_default_worker.shutdown)
+        return _default_worker
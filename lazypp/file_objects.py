@@ -1,10 +1,66 @@
+import json
 import os
-import pickle
 import shutil
-from abc import ABC
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from xxhash import xxh128
+from blake3 import blake3
+
+import lazypp.cache_index
+
+_HASH_CHUNK = 1 << 20
+_MMAP_THRESHOLD = 64 * 1024
+
+
+def _update_with_file(hasher: blake3, path: str | Path) -> blake3:
+    """Feed the contents of a file into hasher"""
+    if os.path.getsize(path) > _MMAP_THRESHOLD:
+        # Let blake3 scan the kernel page cache directly instead of
+        # copying chunks through Python bytes objects
+        hasher.update_mmap(path)
+    else:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+                hasher.update(chunk)
+    return hasher
+
+
+def _hash_file(path: str | Path) -> bytes:
+    """Hash a single file and return the raw digest"""
+    return _update_with_file(blake3(), path).digest()
+
+
+def _fast_copy(src: str | Path, dst: str | Path):
+    """
+    Copy a single file moving as few bytes as possible
+
+    Tries a hardlink first (zero bytes moved on the same filesystem), then
+    os.copy_file_range (in-kernel copy, reflink where the filesystem
+    supports it), and finally falls back to a plain shutil.copyfile.
+    The byte-copy paths create dst with default permissions, so the
+    source mode is copied over afterwards to keep executables executable.
+    """
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        # cross-device link, permissions, or filesystem without hardlinks
+        pass
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        shutil.copymode(src, dst)
+        return
+    except (OSError, AttributeError):
+        pass
+    shutil.copyfile(src, dst)
+    shutil.copymode(src, dst)
 
 
 def _is_outside_base(relative_path: Path) -> bool:
@@ -22,12 +78,21 @@ def _is_outside_base(relative_path: Path) -> bool:
     return False
 
 
-class BaseEntry(ABC):
+class BaseEntry:
     """
     self._src_path: Where the file is located
     self._dest_path: Where the file is copied to
     """
 
+    __slots__ = (
+        "_allow_overwrite",
+        "_copy",
+        "_dest_path",
+        "_hash_cache",
+        "_overwrite_if_exists",
+        "_src_path",
+    )
+
     def __init__(
         self,
         path: str | Path,
@@ -37,6 +102,7 @@ class BaseEntry(ABC):
         allow_overwrite: bool = False,
     ):
         self._copy = copy
+        self._hash_cache: str | None = None
 
         if dest is None:
             self._overwrite_if_exists = True
@@ -47,7 +113,7 @@ class BaseEntry(ABC):
             raise ValueError("File is outside base directory")
         self._src_path = Path(path).resolve()
         self._dest_path = (
-            Path(dest) if dest is not None else Path(self._xxh128_hash().hexdigest())
+            Path(dest) if dest is not None else Path(self._content_digest())
         )
         self._allow_overwrite = allow_overwrite
 
@@ -61,15 +127,103 @@ class BaseEntry(ABC):
     def __repr__(self):
         return f"<{self.__class__.__name__}: {str(self._src_path)} -> {str(self._dest_path)}>"
 
-    def _xxh128_hash(self) -> xxh128:
+    def __getstate__(self):
+        # compact tuple instead of a per-instance __dict__ pickle
+        return (
+            str(self._src_path),
+            str(self._dest_path),
+            self._copy,
+            self._overwrite_if_exists,
+            self._allow_overwrite,
+            self._hash_cache,
+        )
+
+    def __setstate__(self, state):
+        (
+            src_path,
+            dest_path,
+            self._copy,
+            self._overwrite_if_exists,
+            self._allow_overwrite,
+            self._hash_cache,
+        ) = state
+        self._src_path = Path(src_path)
+        self._dest_path = Path(dest_path)
+
+    def _dump_json(self, path: Path):
+        """Write an inspectable descriptor of this entry next to its blob"""
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "kind": type(self).__name__,
+                    "src": str(self._src_path),
+                    "dest": str(self._dest_path),
+                    "copy": self._copy,
+                    "overwrite_if_exists": self._overwrite_if_exists,
+                    "allow_overwrite": self._allow_overwrite,
+                    "hash": self._hash_cache,
+                },
+                f,
+            )
+
+    @classmethod
+    def from_json(cls, data: str | dict) -> "BaseEntry":
+        """Reconstruct an entry from a descriptor written by _dump_json"""
+        if isinstance(data, str):
+            data = json.loads(data)
+        entry = object.__new__(_ENTRY_KINDS[data["kind"]])
+        entry.__setstate__(
+            (
+                data["src"],
+                data["dest"],
+                data["copy"],
+                data["overwrite_if_exists"],
+                data["allow_overwrite"],
+                data["hash"],
+            )
+        )
+        return entry
+
+    def _content_hash(self) -> blake3:
         raise NotImplementedError
 
+    def _content_digest(self) -> str:
+        """Hex digest of the source content, memoized on first call"""
+        if self._hash_cache is None:
+            self._hash_cache = self._content_hash().hexdigest()
+        return self._hash_cache
+
+    def _xxh128_hash(self) -> blake3:
+        """Deprecated alias of :meth:`_content_hash`"""
+        return self._content_hash()
+
+    def _published_source(
+        self, index: "lazypp.cache_index.CacheIndex | None"
+    ) -> Path | None:
+        """
+        Source path of identical already-published content, if any
+
+        Index rows can outlive their blobs (torn cache directories get
+        deleted), so a hit is only trusted while the blob still exists.
+        """
+        if index is None:
+            return None
+        cached = index.get(self._content_digest())
+        if cached is not None and os.path.exists(cached._src_path):
+            return cached._src_path
+        return None
+
     def _copy_to_dest(self, work_dir: Path):
         _ = work_dir
         raise NotImplementedError
 
-    def _cache(self, work_dir: Path, cache_dir: Path):
-        _ = work_dir, cache_dir
+    def _cache(
+        self,
+        work_dir: Path,
+        cache_dir: Path,
+        index: "lazypp.cache_index.CacheIndex | None" = None,
+    ):
+        _ = work_dir, cache_dir, index
         raise NotImplementedError
 
     def copy(self, dest: Path | str):
@@ -82,12 +236,10 @@ class BaseEntry(ABC):
 
 
 class File(BaseEntry):
-    def _xxh128_hash(self):
-        ret = xxh128()
-        with open(self._src_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                ret.update(chunk)
-        return ret
+    __slots__ = ()
+
+    def _content_hash(self):
+        return _update_with_file(blake3(), self._src_path)
 
     def _copy_to_dest(self, work_dir: Path):
         if self._copy:
@@ -95,25 +247,27 @@ class File(BaseEntry):
         else:
             self.link(work_dir / self._dest_path, self._overwrite_if_exists)
 
-    def _cache(self, work_dir: Path, cache_dir: Path):
+    def _cache(
+        self,
+        work_dir: Path,
+        cache_dir: Path,
+        index: "lazypp.cache_index.CacheIndex | None" = None,
+    ):
         """Cache file to cache directory"""
-        cach_path = cache_dir / self._xxh128_hash().hexdigest()
+        cach_path = cache_dir / self._content_digest()
         os.makedirs(cach_path.parent, exist_ok=True)
-        if os.path.islink(work_dir / self._src_path):
-            shutil.copy(
-                os.readlink(work_dir / self._src_path),
-                cache_dir / self._xxh128_hash().hexdigest(),
-            )
-        else:
-            shutil.copy(
-                work_dir / self._src_path, cache_dir / self._xxh128_hash().hexdigest()
-            )
+        if not os.path.exists(cach_path):
+            # hardlink from previously published identical content
+            # instead of copying out of the work dir
+            src = self._published_source(index)
+            if src is None:
+                if os.path.islink(work_dir / self._src_path):
+                    src = os.readlink(work_dir / self._src_path)
+                else:
+                    src = work_dir / self._src_path
+            _fast_copy(src, cach_path)
         self._src_path = cach_path
 
-        # save self instance to cache directory
-        with open(cache_dir / "data", "wb") as f:
-            f.write(pickle.dumps(self))
-
     def copy(self, dest: Path | str, overwrite: bool = False):
         os.makedirs(Path(dest).parent, exist_ok=True)
         if os.path.exists(dest):
@@ -121,7 +275,27 @@ class File(BaseEntry):
                 raise FileExistsError(f"{dest} already exists")
             else:
                 os.remove(dest)
-        shutil.copy(self._src_path, dest)
+        _fast_copy(self._src_path, dest)
+
+    @staticmethod
+    def copy_many(files: "Iterable[File]", dest: Path | str, overwrite: bool = False):
+        """
+        Copy many files under dest, amortizing directory creation
+
+        Each file lands at dest / file.path. Destination parents are
+        created once per unique directory instead of once per file as
+        repeated File.copy calls would do.
+        """
+        dest = Path(dest)
+        targets = [(file, dest / file.path) for file in files]
+        for parent in {target.parent for _, target in targets}:
+            os.makedirs(parent, exist_ok=True)
+        for file, target in targets:
+            if os.path.exists(target):
+                if not (overwrite or file._allow_overwrite):
+                    raise FileExistsError(f"{target} already exists")
+                os.remove(target)
+            _fast_copy(file._src_path, target)
 
     def link(self, dest: Path | str, overwrite: bool = False):
         os.makedirs(Path(dest).parent, exist_ok=True)
@@ -134,14 +308,28 @@ class File(BaseEntry):
 
 
 class Directory(BaseEntry):
-    def _xxh128_hash(self):
-        ret = xxh128()
-        for root, _, files in os.walk(self._src_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                with open(file_path, "rb") as f:
-                    for chunk in iter(lambda: f.read(4096), b""):
-                        ret.update(chunk)
+    __slots__ = ()
+
+    def _content_hash(self):
+        file_paths = []
+        for root, dirs, files in os.walk(self._src_path):
+            dirs.sort()
+            for file in sorted(files):
+                file_paths.append(os.path.join(root, file))
+
+        ret = blake3()
+        if len(file_paths) <= 1:
+            digests = map(_hash_file, file_paths)
+        else:
+            # File reads and blake3 both release the GIL, so hashing the
+            # files on a thread pool overlaps I/O with hash compute
+            with ThreadPoolExecutor(
+                max_workers=min(32, (os.cpu_count() or 1) * 4)
+            ) as pool:
+                digests = pool.map(_hash_file, file_paths)
+        for file_path, digest in zip(file_paths, digests):
+            ret.update(os.path.relpath(file_path, self._src_path).encode())
+            ret.update(digest)
         return ret
 
     def _copy_to_dest(self, work_dir: Path):
@@ -150,21 +338,25 @@ class Directory(BaseEntry):
         else:
             self.link(work_dir / self._dest_path, self._overwrite_if_exists)
 
-    def _cache(self, work_dir: Path, cache_dir: Path):
+    def _cache(
+        self,
+        work_dir: Path,
+        cache_dir: Path,
+        index: "lazypp.cache_index.CacheIndex | None" = None,
+    ):
         """Cache directory to cache directory"""
-        cache_path = cache_dir / self._xxh128_hash().hexdigest()
+        cache_path = cache_dir / self._content_digest()
         os.makedirs(cache_path.parent, exist_ok=True)
 
-        if os.path.islink(work_dir / self._src_path):
-            shutil.copytree(os.readlink(work_dir / self._src_path), cache_path)
-        else:
-            shutil.copytree(work_dir / self._src_path, cache_path)
+        src = self._published_source(index)
+        if src is None:
+            if os.path.islink(work_dir / self._src_path):
+                src = os.readlink(work_dir / self._src_path)
+            else:
+                src = work_dir / self._src_path
+        shutil.copytree(src, cache_path, copy_function=_fast_copy)
         self._src_path = cache_path
 
-        # save self instance to cache directory
-        with open(cache_dir / "data", "wb") as f:
-            f.write(pickle.dumps(self))
-
     def copy(self, dest: Path | str, overwrite: bool = False):
         os.makedirs(Path(dest).parent, exist_ok=True)
         if os.path.exists(dest):
@@ -175,7 +367,7 @@ class Directory(BaseEntry):
                     os.remove(dest)
                 else:
                     shutil.rmtree(dest)
-        shutil.copytree(self._src_path, dest)
+        shutil.copytree(self._src_path, dest, copy_function=_fast_copy)
 
     def link(self, dest: Path | str, overwrite: bool = False):
         os.makedirs(Path(dest).parent, exist_ok=True)
@@ -188,3 +380,9 @@ class Directory(BaseEntry):
                 else:
                     shutil.rmtree(dest)
         os.symlink(self._src_path, dest)
+
+
+_ENTRY_KINDS: dict[str, type[BaseEntry]] = {
+    "File": File,
+    "Directory": Directory,
+}
@@ -1,17 +1,19 @@
 import asyncio
 import contextlib
 import copy
+import errno
 import json
+import mmap
 import os
 import pickle
 import shutil
 from abc import ABC
-from collections import defaultdict
+from collections import deque
 from collections.abc import Mapping, Sequence
-from concurrent.futures import ProcessPoolExecutor
-from inspect import getsource
+from concurrent.futures import Executor, ThreadPoolExecutor
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from types import CodeType
 from typing import Any, Callable, TypeGuard, cast
 
 from rich.console import Console
@@ -19,6 +21,7 @@ from xxhash import xxh128
 
 import lazypp.dummy_output
 
+from .cache_index import CacheIndex
 from .file_objects import BaseEntry
 
 console = Console(
@@ -27,6 +30,84 @@ console = Console(
 
 _DEBUG = False
 
+# serializes background deletion of stale cache directories so the hot
+# path never blocks on rmtree of a large tree
+_cleanup_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lazypp-cleanup")
+
+
+def _eager_loop() -> asyncio.AbstractEventLoop:
+    loop = asyncio.new_event_loop()
+    loop.set_task_factory(asyncio.eager_task_factory)
+    return loop
+
+
+class _HashSink:
+    """File-like adapter feeding pickled bytes straight into a hasher"""
+
+    __slots__ = ("_hasher",)
+
+    def __init__(self, hasher):
+        self._hasher = hasher
+
+    def write(self, data) -> int:
+        self._hasher.update(data)
+        return len(data)
+
+
+def _canonical_hash_value(value: Any) -> Any:
+    """
+    Rewrite unordered containers into a deterministically ordered form
+
+    set and frozenset iterate in hash-seed order, so pickling them
+    directly would stream their elements differently in every
+    interpreter run and the task hash would never match a warm cache.
+    They are replaced by a type-tagged tuple of elements sorted by
+    repr; plain dicts, lists and tuples are walked through so nested
+    sets are caught as well.
+    """
+    if isinstance(value, (set, frozenset)):
+        return (
+            type(value),
+            tuple(sorted((_canonical_hash_value(v) for v in value), key=repr)),
+        )
+    if type(value) is dict:
+        return {key: _canonical_hash_value(v) for key, v in value.items()}
+    if type(value) in (list, tuple):
+        return type(value)(_canonical_hash_value(v) for v in value)
+    return value
+
+
+def _code_digest(code: CodeType) -> str:
+    """
+    Digest of a code object's behaviour, stable across processes
+
+    Hashing co_code plus names and constants replaces getsource, which
+    re-read and re-parsed the source file on every hash calculation.
+    Nested code objects (lambdas, comprehensions, inner defs) are
+    recursed into rather than repr'd, since their repr embeds a memory
+    address, and frozenset constants (membership tests like
+    x in {"a", "b"}) are folded in sorted order, since their iteration
+    order depends on the hash seed; either would make the digest
+    nondeterministic.
+    """
+    h = xxh128()
+
+    def update(c: CodeType):
+        h.update(c.co_code)
+        h.update(repr(c.co_varnames).encode())
+        h.update(repr(c.co_names).encode())
+        for const in c.co_consts:
+            if isinstance(const, CodeType):
+                update(const)
+            elif isinstance(const, frozenset):
+                for item in sorted(map(repr, const)):
+                    h.update(item.encode())
+            else:
+                h.update(repr(const).encode())
+
+    update(code)
+    return h.hexdigest()
+
 
 def _is_valid_input(input: Any) -> TypeGuard[dict[str, Any] | None]:
     if input is None:
@@ -57,28 +138,42 @@ def _is_valid_output[OUTPUT](input: OUTPUT | None) -> TypeGuard[OUTPUT]:
 
 
 class BaseTask[INPUT, OUTPUT](ABC):
-    _global_locks = defaultdict(asyncio.Lock)
+    # single-flight map: hash -> future of the first task computing it
+    _inflight: dict[str, asyncio.Future] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # digest the task body once at class definition; subclasses that
+        # inherit task pick the digest up from the defining class via MRO
+        if "task" in cls.__dict__:
+            cls._task_source_hash = _code_digest(cls.task.__code__)
 
     def __init__(
         self,
         *,
         cache_dir: str | Path,
         input: INPUT,
-        worker: ProcessPoolExecutor | None = None,
+        worker: Executor | None = None,
         work_dir: str | Path | None = None,
         show_input: bool = False,
         show_output: bool = False,
+        mutable_input: bool = False,
     ):
         self._work_dir: Path | TemporaryDirectory | None = (
             Path(work_dir) if work_dir else None
         )
         self._worker = worker
         self._cache_dir = Path(cache_dir)
+        if not _is_valid_input(input):
+            raise ValueError(
+                "Input should be a dictionary with string keys and have pickleable values"
+            )
         self._input = input
         self._output: OUTPUT | None = None
         self._output_lock = asyncio.Lock()
         self._show_input = show_input
         self._show_output = show_output
+        self._mutable_input = mutable_input
         self._hash: str | None = None
         self._upstream_results: list[Any] | None = None
 
@@ -87,7 +182,10 @@ class BaseTask[INPUT, OUTPUT](ABC):
         raise NotImplementedError
 
     def result(self) -> OUTPUT:
-        return asyncio.run(self())
+        # eager tasks let warm-cache dependencies finish without a trip
+        # through the scheduler queue
+        with asyncio.Runner(loop_factory=_eager_loop) as runner:
+            return runner.run(self())
 
     def _log_input(self):
         if self._show_input:
@@ -110,23 +208,20 @@ class BaseTask[INPUT, OUTPUT](ABC):
             self._upstream_results = []
             return
 
-        dependent_tasks = []
-        _call_func_on_specific_class(
-            self._input,
-            lambda task: dependent_tasks.append(asyncio.create_task(task())),
-            BaseTask,
+        # one walk collects both leaf kinds instead of three passes
+        buckets = _collect_instances(
+            self._input, (BaseTask, lazypp.dummy_output.DummyOutput)
         )
-        _call_func_on_specific_class(
-            self._input,
-            lambda output: dependent_tasks.append(asyncio.create_task(output.task())),
-            lazypp.dummy_output.DummyOutput,
+        dependent_tasks = [
+            asyncio.create_task(task()) for _, _, task in buckets[BaseTask]
+        ]
+        dummy_outputs = buckets[lazypp.dummy_output.DummyOutput]
+        dependent_tasks.extend(
+            asyncio.create_task(output.task()) for _, _, output in dummy_outputs
         )
         self._upstream_results = await asyncio.gather(*dependent_tasks)
-        _call_func_on_specific_class(
-            self._input,
-            lambda output: output.restore_output(),
-            lazypp.dummy_output.DummyOutput,
-        )
+        for parent, key, output in dummy_outputs:
+            parent[key] = output.restore_output() or output
 
     async def _setup_workdir(self):
         """Setup the Task
@@ -139,27 +234,49 @@ class BaseTask[INPUT, OUTPUT](ABC):
         elif self._upstream_results is None:
             raise ValueError("Upstream results are not collected")
 
-        # Restore output
-        _call_func_on_specific_class(
-            self._input,
-            lambda entry: entry._copy_to_dest(self.work_dir),
-            BaseEntry,
-        )
+        entries: list[BaseEntry] = []
+        _call_func_on_specific_class(self._input, entries.append, BaseEntry)
         for output in self._upstream_results:
-            _call_func_on_specific_class(
-                output,
-                lambda entry: entry._copy_to_dest(self.work_dir),
-                BaseEntry,
+            _call_func_on_specific_class(output, entries.append, BaseEntry)
+
+        # one copy per destination path; the copies are blocking file
+        # I/O, so fan them out on threads instead of serializing them
+        # on the event loop
+        unique: dict[Path, BaseEntry] = {}
+        for entry in entries:
+            unique.setdefault(self.work_dir / entry._dest_path, entry)
+        if unique:
+            await asyncio.gather(
+                *(
+                    asyncio.to_thread(entry._copy_to_dest, self.work_dir)
+                    for entry in unique.values()
+                )
             )
 
     async def __call__(self) -> OUTPUT:
+        # _output is set once and never cleared, so a lock-free read is
+        # safe; shared upstream tasks skip a lock cycle per consumer
+        if self._output is not None:
+            return self._output
         async with self._output_lock:
             if self._output is not None:
                 return self._output
 
             await self._collect_upstream_results()
 
-            async with BaseTask._global_locks[await self.get_hash()]:
+            hash = await self.get_hash()
+            inflight = BaseTask._inflight.get(hash)
+            if inflight is not None:
+                # another task with the same hash is already computing;
+                # share its in-memory result instead of waiting on a
+                # lock only to re-read the cache from disk
+                self._output = cast(OUTPUT, await inflight)
+                self._log_output()
+                return self._output
+
+            fut: asyncio.Future = asyncio.get_running_loop().create_future()
+            BaseTask._inflight[hash] = fut
+            try:
                 if self._check_cache():
                     self._output = self._load_from_cache()
                     console.log(
@@ -167,41 +284,59 @@ class BaseTask[INPUT, OUTPUT](ABC):
                     )
                     self._log_input()
                     self._log_output()
+                    fut.set_result(self._output)
                     return self._output
+                await self._setup_workdir()
                 if self._worker is None:
-                    await self._setup_workdir()
                     self._output = self._run_task_in_workdir(self.work_dir)
                 else:
-                    await self._setup_workdir()
-                    loop = asyncio.get_event_loop()
+                    loop = asyncio.get_running_loop()
                     self._output = await loop.run_in_executor(
                         self._worker, self._run_task_in_workdir, self.work_dir
                     )
-            self._cache_output()
-            if not _is_valid_output(self._output):
-                raise ValueError(
-                    "Output should be a dictionary with string keys and have pickleable values"
-                )
-            self._log_output()
-            return self._output
+                if not _is_valid_output(self._output):
+                    raise ValueError(
+                        "Output should be a dictionary with string keys and have pickleable values"
+                    )
+                self._cache_output()
+                self._log_output()
+                fut.set_result(self._output)
+                return self._output
+            except BaseException as e:
+                fut.set_exception(e)
+                fut.exception()  # waiters still re-raise; silence GC warning
+                raise
+            finally:
+                BaseTask._inflight.pop(hash, None)
 
     async def get_hash(self) -> str:
         if self._hash is not None:
             return self._hash
-        if self._worker is not None:
-            loop = asyncio.get_event_loop()
+        if self._worker is not None and self._has_entry_input():
+            loop = asyncio.get_running_loop()
             self._hash = str(
                 await loop.run_in_executor(self._worker, self._calculate_hash)
             )
         else:
+            # hashing without file entries is pure dict work; pickling
+            # self through the executor would cost more than the hash
             self._hash = self._calculate_hash()
         return self._hash
 
+    def _has_entry_input(self) -> bool:
+        if self._input is None:
+            return False
+        return bool(_collect_instances(self._input, (BaseEntry,))[BaseEntry])
+
     def _run_task_in_workdir(self, work_dir: Path) -> OUTPUT:
         with contextlib.chdir(work_dir):
             console.log(f"{self.__class__.__name__}: Running in {os.getcwd()}")
             self._log_input()
-            return self.task(copy.deepcopy(self._input))
+            # Tasks must not mutate their input; pass mutable_input=True
+            # to get a private deep copy instead
+            if self._mutable_input:
+                return self.task(copy.deepcopy(self._input))
+            return self.task(self._input)
 
     @property
     def output(self) -> OUTPUT:
@@ -217,41 +352,78 @@ class BaseTask[INPUT, OUTPUT](ABC):
         Check if cache exists
         If corresponding hash directory or output files are not found return False
         """
-        if os.path.exists(self._cache_dir / self.hash / "data"):
-            return True
-        return False
+        try:
+            os.stat(self._cache_dir / self.hash / "data")
+        except FileNotFoundError:
+            return False
+        return True
 
     def _load_from_cache(self) -> OUTPUT:
         """
         Load output from cache,
         unpickle "cache_dir/hash/data" file and return the output
         """
-        if not os.path.exists(self._cache_dir / self.hash):
-            raise FileNotFoundError(f"Cache for {self.hash} not found")
-        return cast(
-            OUTPUT, pickle.load(open(self._cache_dir / self.hash / "data", "rb"))
-        )
+        with open(self._cache_dir / self.hash / "data", "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return cast(OUTPUT, pickle.loads(mm))
 
     def _cache_output(self):
-        if not _is_valid_output(self._output):
-            raise ValueError("Output should be a dictionary with string keys")
+        target = self._cache_dir / self.hash
+        if os.path.exists(target / "data"):
+            # content-addressed by hash: an existing cache holds the same
+            # data by construction, so rewriting it is wasted I/O
+            return
 
-        # remove if exists
-        if os.path.exists(self._cache_dir / self.hash):
-            shutil.rmtree(self._cache_dir / self.hash)
+        # move a torn cache aside and delete it in the background
+        stale = target.with_name(f".{target.name}.old.{os.getpid()}")
+        try:
+            os.rename(target, stale)
+            _cleanup_pool.submit(shutil.rmtree, stale, True)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # a leftover stale directory blocked the rename
+            shutil.rmtree(target)
 
-        os.makedirs(self._cache_dir / self.hash)
         if _DEBUG:
             console.log(f"{self.__class__.__name__}: Caching output")
 
+        # stage everything in a private directory, then publish with one
+        # atomic rename so readers never see a partially written cache
+        tmp = target.with_name(f".{target.name}.tmp.{os.getpid()}")
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+
+        index = CacheIndex.for_dir(self._cache_dir)
         _call_func_on_specific_class(
             self._output,
-            lambda entry: entry._cache(self.work_dir, self._cache_dir / self.hash),
+            lambda entry: entry._cache(self.work_dir, tmp, index),
             BaseEntry,
         )
 
-        with open(self._cache_dir / self.hash / "data", "wb") as f:
-            f.write(pickle.dumps(self._output))
+        # _cache pointed the entries into tmp; re-point them at the
+        # published path before the descriptors, pickle and index see
+        # them, so nothing on disk records the staging directory
+        def _publish(entry: BaseEntry):
+            entry._src_path = target / entry._src_path.name
+            entry._dump_json(tmp / (entry._src_path.name + ".json"))
+
+        _call_func_on_specific_class(self._output, _publish, BaseEntry)
+        _call_func_on_specific_class(self._output, index.record, BaseEntry)
+
+        with open(tmp / "data", "wb") as f:
+            f.write(pickle.dumps(self._output, protocol=pickle.HIGHEST_PROTOCOL))
+
+        try:
+            os.replace(tmp, target)
+        except OSError as e:
+            # losing the publication race to another writer is benign;
+            # anything else (EACCES, EXDEV, ENOSPC, ...) means the cache
+            # was not written and must not be swallowed
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+            shutil.rmtree(tmp)
 
         if _DEBUG:
             console.log(f"{self.__class__.__name__}: Caching output done")
@@ -263,7 +435,27 @@ class BaseTask[INPUT, OUTPUT](ABC):
         """
         if _DEBUG:
             console.log(f"{self.__class__.__name__}: Calculating hash")
-        res = xxh128(self._dump_input().encode()).hexdigest()
+        h = xxh128()
+        h.update(self._source_hash().encode())
+        hashable = self._hashable_input()
+        if hashable is not None:
+            # stream key/value pairs straight into the hasher rather
+            # than formatting one large JSON document first
+            for key in sorted(hashable):
+                h.update(key.encode())
+                h.update(b"\0")
+                try:
+                    h.update(json.dumps(hashable[key]).encode())
+                except TypeError:
+                    # not JSON-serializable: stream the pickle into the
+                    # hasher without building the intermediate bytes,
+                    # with unordered containers put in canonical order
+                    # first so the stream is stable across processes
+                    pickle.Pickler(_HashSink(h), protocol=pickle.HIGHEST_PROTOCOL).dump(
+                        _canonical_hash_value(hashable[key])
+                    )
+                h.update(b"\0")
+        res = h.hexdigest()
         if _DEBUG:
             console.log(f"{self.__class__.__name__}: Calculating hash done")
         return res
@@ -274,25 +466,36 @@ class BaseTask[INPUT, OUTPUT](ABC):
             raise ValueError("Hash is not calculated. Run the task to calculate hash")
         return str(self._hash)
 
-    def _dump_input(self, indent: bool | int = False) -> str:
-        """
-        Dump input to as json string
+    def _source_hash(self) -> str:
+        cls = type(self)
+        source_hash = getattr(cls, "_task_source_hash", None)
+        if source_hash is None:
+            source_hash = cls._task_source_hash = _code_digest(self.task.__code__)
+        return source_hash
+
+    def _hashable_input(self) -> dict[str, Any] | None:
         """
-        if not _is_valid_input(self._input):
-            raise ValueError(
-                "Input should be a dictionary with string keys and have pickleable values"
-            )
+        Copy of input with entries and tasks replaced by their digests
 
-        source_hash = xxh128(getsource(self.task.__code__).encode()).hexdigest()
+        Input shape was validated once in __init__.
+        """
         if self._input is None:
-            return json.dumps({"__lazypp_task_source__": source_hash})
+            return None
 
         ret = copy.deepcopy(self._input)
 
-        ret["__lazypp_task_source__"] = source_hash
+        entries: list[BaseEntry] = []
+        _call_func_on_specific_class(ret, entries.append, BaseEntry)
+        if len(entries) > 1:
+            # warm the memoized digests in parallel; file reads and
+            # blake3 both release the GIL
+            with ThreadPoolExecutor(
+                max_workers=min(32, (os.cpu_count() or 1) * 4)
+            ) as pool:
+                list(pool.map(BaseEntry._content_digest, entries))
         _call_func_on_specific_class(
             ret,
-            lambda entry: entry._xxh128_hash().hexdigest(),
+            lambda entry: entry._content_digest(),
             BaseEntry,
         )
         _call_func_on_specific_class(
@@ -300,6 +503,15 @@ class BaseTask[INPUT, OUTPUT](ABC):
             lambda task: task.hash,
             BaseTask,
         )
+        return ret
+
+    def _dump_input(self, indent: bool | int = False) -> str:
+        """
+        Dump input as a json string, for debugging and inspection only;
+        _calculate_hash streams the same data without building the string
+        """
+        ret = self._hashable_input() or {}
+        ret["__lazypp_task_source__"] = self._source_hash()
         return json.dumps(ret, indent=indent)
 
     @property
@@ -318,6 +530,10 @@ class BaseTask[INPUT, OUTPUT](ABC):
         state = self.__dict__.copy()
         state["_worker"] = None  # worker is not picklable
         state["_output_lock"] = None  # lock is not picklable
+        # the worker only runs the task body on _input; upstream outputs
+        # were already restored into _input, so shipping them again just
+        # inflates every executor submission
+        state["_upstream_results"] = None
         return state
 
     def __setstate__(self, state):
@@ -325,32 +541,88 @@ class BaseTask[INPUT, OUTPUT](ABC):
         self._output_lock = asyncio.Lock()
 
 
+def _collect_instances(
+    obj: Any, types: tuple[type, ...]
+) -> dict[type, list[tuple[Any, Any, Any]]]:
+    """
+    Collect (parent, key, instance) triples for every leaf of the given
+    types in a single walk, bucketed by type
+
+    The triples stay valid until the tree is mutated; callers that
+    replace leaves through the parents must not reuse the index after.
+    """
+    buckets: dict[type, list[tuple[Any, Any, Any]]] = {t: [] for t in types}
+    visited = set()
+    queue: deque[tuple[Any, Any, Any]] = deque([(obj, None, None)])
+    while queue:
+        inner_obj, parent, key = queue.popleft()
+        if id(inner_obj) in visited:
+            continue
+        visited.add(id(inner_obj))
+
+        matched = False
+        for t in types:
+            if isinstance(inner_obj, t):
+                buckets[t].append((parent, key, inner_obj))
+                matched = True
+                break
+        if matched:
+            continue
+
+        typ = type(inner_obj)
+        if typ is dict:
+            for k, v in inner_obj.items():
+                queue.append((v, inner_obj, k))
+        elif typ is list or typ is tuple:
+            for i, v in enumerate(inner_obj):
+                queue.append((v, inner_obj, i))
+        elif isinstance(inner_obj, Mapping):
+            for k, v in inner_obj.items():
+                queue.append((v, inner_obj, k))
+        elif isinstance(inner_obj, Sequence) and not isinstance(
+            inner_obj, (str, bytes, bytearray)
+        ):
+            for i, v in enumerate(inner_obj):
+                queue.append((v, inner_obj, i))
+
+    return buckets
+
+
 def _call_func_on_specific_class[T](
     obj: Any, func: Callable[[T], Any], t: type[T]
 ) -> Any:
-    visited = set()
+    if isinstance(obj, t):
+        return func(obj) or obj
 
-    def call_func_inner(inner_obj: Any, parent: Any = None, key: Any = None) -> None:
+    # iterative walk: no Python frame per node, and exact type checks
+    # for the common containers before falling back to ABC dispatch
+    visited = set()
+    queue: deque[tuple[Any, Any, Any]] = deque([(obj, None, None)])
+    while queue:
+        inner_obj, parent, key = queue.popleft()
         if id(inner_obj) in visited:
-            return
+            continue
         visited.add(id(inner_obj))
 
         if isinstance(inner_obj, t):
             if parent is not None:
                 parent[key] = func(inner_obj) or inner_obj
-            return
+            continue
 
-        if isinstance(inner_obj, Mapping):
+        typ = type(inner_obj)
+        if typ is dict:
             for k, v in inner_obj.items():
-                call_func_inner(v, inner_obj, k)
+                queue.append((v, inner_obj, k))
+        elif typ is list or typ is tuple:
+            for i, v in enumerate(inner_obj):
+                queue.append((v, inner_obj, i))
+        elif isinstance(inner_obj, Mapping):
+            for k, v in inner_obj.items():
+                queue.append((v, inner_obj, k))
         elif isinstance(inner_obj, Sequence) and not isinstance(
             inner_obj, (str, bytes, bytearray)
         ):
             for i, v in enumerate(inner_obj):
-                call_func_inner(v, inner_obj, i)
-
-    if isinstance(obj, t):
-        return func(obj) or obj
+                queue.append((v, inner_obj, i))
 
-    call_func_inner(obj)
     return obj
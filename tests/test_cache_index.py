@@ -0,0 +1,19 @@
+from lazypp import File
+from lazypp.cache_index import CacheIndex
+
+
+def test_record_and_get(tmpdir):
+    index = CacheIndex(tmpdir)
+
+    file = File("tests/data/hello1.txt")
+    index.record(file)
+
+    restored = index.get(file._content_digest())
+    assert restored is not None
+    assert restored._src_path == file._src_path
+
+    assert index.get("no such hash") is None
+
+
+def test_for_dir_is_shared(tmpdir):
+    assert CacheIndex.for_dir(tmpdir) is CacheIndex.for_dir(tmpdir)
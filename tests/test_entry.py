@@ -1,3 +1,5 @@
+from pathlib import Path
+
 import pytest
 
 from lazypp import Directory, File
@@ -18,3 +20,42 @@ def test_hash():
     dir2 = Directory("tests/data/foo2")
 
     assert dir1._xxh128_hash().hexdigest() != dir2._xxh128_hash().hexdigest()
+
+
+def test_copy_many(tmpdir):
+    dest = Path(tmpdir)
+    file1 = File("tests/data/hello1.txt", dest="out/hello1.txt")
+    file2 = File("tests/data/hello2.txt", dest="out/hello2.txt")
+
+    File.copy_many([file1, file2], dest)
+
+    assert (dest / "out/hello1.txt").read_bytes() == Path(
+        "tests/data/hello1.txt"
+    ).read_bytes()
+    assert (dest / "out/hello2.txt").read_bytes() == Path(
+        "tests/data/hello2.txt"
+    ).read_bytes()
+
+    # without an explicit dest the file lands under its content digest
+    file3 = File("tests/data/hello1.txt")
+    File.copy_many([file3], dest)
+    assert (dest / file3.path).read_bytes() == Path(
+        "tests/data/hello1.txt"
+    ).read_bytes()
+
+
+def test_copy_many_overwrite(tmpdir):
+    dest = Path(tmpdir)
+    file = File("tests/data/hello1.txt", dest="hello.txt")
+
+    File.copy_many([file], dest)
+    with pytest.raises(FileExistsError):
+        File.copy_many([file], dest)
+    File.copy_many([file], dest, overwrite=True)
+
+    # allow_overwrite on the entry itself also permits the rewrite
+    relaxed = File("tests/data/hello2.txt", dest="hello.txt", allow_overwrite=True)
+    File.copy_many([relaxed], dest)
+    assert (dest / "hello.txt").read_bytes() == Path(
+        "tests/data/hello2.txt"
+    ).read_bytes()